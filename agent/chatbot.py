@@ -1,138 +1,504 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
+from google.genai import errors, types
 from dotenv import load_dotenv
-from langchain_core.messages import HumanMessage, AIMessage, SystemMessage, BaseMessage
+from langchain_core.messages import HumanMessage
+from langchain_core.messages import trim_messages
+from langchain_core.messages.utils import count_tokens_approximately
+from agent.prompts import sys_prompt, PROMPT_SHA
 from langgraph.graph.message import add_messages
 from langgraph.graph import StateGraph, START, END
 from typing_extensions import TypedDict, Annotated
-from langgraph.checkpoint.postgres import PostgresSaver
+from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+from psycopg_pool import AsyncConnectionPool
+from cachetools import TTLCache
+import orjson
+import asyncio
+import hashlib
+import logging
 import os
-import psycopg
+import time
+import weakref
+from datetime import datetime, timezone
 
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 DB_URL = os.getenv("SUPABASE_DB_URL")
 
-connection = psycopg.connect(DB_URL, sslmode="require", autocommit=True)
+# Server-side prepared statements break behind transaction-mode poolers
+# such as PgBouncer / Supavisor, so they are off by default. On a direct or
+# session-mode connection set DB_PREPARE_THRESHOLD=0 to prepare every
+# statement and let Postgres reuse the plans of the checkpoint queries.
+DB_PREPARE_THRESHOLD = os.getenv("DB_PREPARE_THRESHOLD")
+# Use DB_SSLMODE=verify-full (with a root cert) to also verify the server
+DB_SSLMODE = os.getenv("DB_SSLMODE", "require")
+
+# Connections are checked out per operation; the pool is opened and closed
+# by the FastAPI lifespan (see open_pool / close_pool below).
+pool = AsyncConnectionPool(
+    DB_URL,
+    min_size=5,
+    max_size=20,
+    kwargs={
+        "autocommit": True,
+        "sslmode": DB_SSLMODE,
+        "prepare_threshold": (
+            int(DB_PREPARE_THRESHOLD) if DB_PREPARE_THRESHOLD else None
+        ),
+    },
+    open=False,
+)
 
 
-llm = ChatGoogleGenerativeAI(model="gemini-3-flash-preview", temperature=1.5, max_retries=2)
+LLM_MODEL = "gemini-3-flash-preview"
+PROMPT_CACHE_TTL = 3600  # seconds
+# Each worker extends the prompt cache this long before its own view of
+# the expiry, so no request races it
+PROMPT_CACHE_REFRESH_MARGIN = 300  # seconds
+# Upper bound on conversation tokens sent to Gemini per turn
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "8000"))
+
+# Per-worker cap on in-flight Gemini calls: bursts queue here instead of
+# tripping the quota and retrying into an already saturated API
+_llm_sem = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", "32")))
+
+# max_output_tokens bounds the long-tail generations; the JSON mime type
+# makes Gemini enforce the {ai_message, canvas, title} output format.
+# Gemini 3 is a thinking model and thinking tokens count against
+# max_output_tokens, so thinking is kept low to leave the cap for the
+# canvas; hitting it would cut the JSON off mid-reply.
+# Temperature stays at Gemini 3's default of 1.0: Google advises against
+# lowering it, which can make the model loop or degrade its output.
+llm = ChatGoogleGenerativeAI(
+    model=LLM_MODEL,
+    temperature=1.0,
+    max_output_tokens=8192,
+    thinking_level="low",
+    response_mime_type="application/json",
+    max_retries=2,
+)
 
 
-sys_prompt = SystemMessage(
-    content="""
-You are a Senior Generative Graphic Designer & HTML5 Canvas Engineer. Your job is to produce visually striking, professional-grade flyer designs using only raw HTML + vanilla JavaScript (Canvas API) based on user input.
+# Gemini context cache holding sys_prompt, so it is not resent every turn
 
-Your output must demonstrate: • Strong visual hierarchy • Balanced spacing and alignment • Zero text overlap • Intentional use of white space • Modern design principles
+# Same prompt text -> same display name, so workers and restarts find and
+# keep extending one shared cache instead of each creating their own
+PROMPT_CACHE_DISPLAY_NAME = f"recto-sys-prompt-{PROMPT_SHA}"
 
-🎨 DESIGN INTELLIGENCE
-Layout & Composition
+_prompt_cache_name: str | None = None
+_prompt_cache_expires_at = 0.0
+_prompt_cache_lock = asyncio.Lock()
+# Set once Gemini rejects the cache outright; sys_prompt is then sent
+# inline for the rest of the process instead of retrying every 5 minutes
+_prompt_cache_disabled = False
 
-Always design using clear visual hierarchy: headline → subhead → details → CTA.
 
-Respect margins, padding, and breathing room. Never crowd the canvas.
+async def _find_prompt_cache():
+    """
+    Looks for a live cache of this exact prompt and model, or None.
+    Workers starting together may each have created one; the oldest is
+    picked, so they all converge on it and the others expire.
+    """
+    found = []
+    async for cache in await llm.client.aio.caches.list():
+        if cache.display_name != PROMPT_CACHE_DISPLAY_NAME:
+            continue
+        if not cache.model.endswith(LLM_MODEL):
+            continue
+        seconds_left = (cache.expire_time - datetime.now(timezone.utc)).total_seconds()
+        # Leave time for the TTL update to land before it expires
+        if seconds_left > 60:
+            found.append(cache)
+    return min(found, key=lambda cache: (cache.create_time, cache.name), default=None)
+
+
+async def ensure_prompt_cache():
+    """
+    Returns the name of the Gemini cached content that holds sys_prompt,
+    extending the shared cache (or creating it when missing) when close to
+    expiry.
+    Returns None if caching is unavailable (e.g. the prompt is below the
+    model's minimum cacheable size); sys_prompt is then sent inline.
+    """
+    global _prompt_cache_name, _prompt_cache_expires_at, _prompt_cache_disabled
+
+    if _prompt_cache_disabled or time.monotonic() < _prompt_cache_expires_at:
+        return _prompt_cache_name
+
+    async with _prompt_cache_lock:
+        # Another request may have refreshed it while we waited
+        if _prompt_cache_disabled or time.monotonic() < _prompt_cache_expires_at:
+            return _prompt_cache_name
+        try:
+            # Go through the LLM's own google-genai client so this shares
+            # (and warms) the same HTTP connection pool as chat requests
+            cache = await _find_prompt_cache()
+            if cache is not None:
+                cache = await llm.client.aio.caches.update(
+                    name=cache.name,
+                    config=types.UpdateCachedContentConfig(
+                        ttl=f"{PROMPT_CACHE_TTL}s"
+                    ),
+                )
+            else:
+                cache = await llm.client.aio.caches.create(
+                    model=LLM_MODEL,
+                    config=types.CreateCachedContentConfig(
+                        display_name=PROMPT_CACHE_DISPLAY_NAME,
+                        system_instruction=sys_prompt.content,
+                        ttl=f"{PROMPT_CACHE_TTL}s",
+                    ),
+                )
+            _prompt_cache_name = cache.name
+            _prompt_cache_expires_at = (
+                time.monotonic() + PROMPT_CACHE_TTL - PROMPT_CACHE_REFRESH_MARGIN
+            )
+        except Exception as e:
+            logger.warning("Prompt cache unavailable, sending system prompt inline: %s", e)
+            _prompt_cache_name = None
+            if isinstance(e, errors.ClientError) and e.code == 400:
+                # INVALID_ARGUMENT won't change on retry (usually sys_prompt
+                # is below the model's minimum cacheable size), so stop here
+                _prompt_cache_disabled = True
+            else:
+                # Don't retry on every request
+                _prompt_cache_expires_at = time.monotonic() + 300
+
+        return _prompt_cache_name
+
+
+async def keep_prompt_cache_fresh():
+    """
+    Background task that extends the prompt cache just before it
+    expires, so chat requests never wait on the refresh themselves.
+    Returns once caching has been disabled.
+    """
+    while True:
+        await ensure_prompt_cache()
+        if _prompt_cache_disabled:
+            return
+        await asyncio.sleep(max(_prompt_cache_expires_at - time.monotonic(), 1))
 
-Use grids, alignment, and negative space intentionally.
 
-Prevent any text or element overlap at all times.
+async def warm_up_llm():
+    """
+    Opens the Gemini HTTP connection on startup so the first user request
+    doesn't pay the TLS + auth handshake. Spends no tokens.
+    """
+    if await ensure_prompt_cache() is not None:
+        # Creating the prompt cache already went over the connection
+        return
+    try:
+        await llm.client.aio.models.get(model=LLM_MODEL)
+    except Exception as e:
+        logger.warning("Gemini warm-up failed: %s", e)
 
-Typography (MANDATORY)
 
-You MUST use professional Google Fonts only (e.g., Montserrat, Playfair Display, Poppins, Oswald, Lato).
+# Setting Message state
+class State(TypedDict):
+    messages: Annotated[list, add_messages]
 
-Import fonts using @import inside the <style> block.
 
-Apply type hierarchy (Bold headlines, readable body).
+# Setting up nodes
+async def chat_node(state: State):
+    # Only the most recent turns are sent, so prompt size stays bounded
+    # however long the session grows. The full history stays checkpointed.
+    history = trim_messages(
+        state["messages"],
+        max_tokens=HISTORY_MAX_TOKENS,
+        strategy="last",
+        token_counter=count_tokens_approximately,
+        start_on="human",
+    ) or state["messages"][-1:]
+
+    cached_content = await ensure_prompt_cache()
+    async with _llm_sem:
+        if cached_content:
+            # sys_prompt already lives in the cache, only send the conversation
+            response = await llm.ainvoke(history, cached_content=cached_content)
+        else:
+            messages = [sys_prompt] + history
+            response = await llm.ainvoke(messages)
+    return {"messages": [response]}
 
-Imagery Rules
 
-Use stock images ONLY when realism is essential.
+# Building Graph
 
-Otherwise, create abstract, geometric, or gradient-based compositions.
 
-💎 ICONOGRAPHY RULES (MANDATORY)
-You must use Google Material Symbols for all icons (phone, email, location, arrows, etc.). Since this is a Canvas, you MUST treat icons as Text Fonts, not images.
+def build_graph(checkpointer):
+    """
+    Builds and compiles the chat graph. Called once per process, so the
+    whole app shares one compiled graph and one checkpointer.
+    """
+    builder = StateGraph(State)
+    builder.add_node("chat_node", chat_node)
+    builder.add_edge(START, "chat_node")
+    builder.add_edge("chat_node", END)
+    return builder.compile(checkpointer=checkpointer)
 
-Import: Add this exactly to your CSS @import: url('https://fonts.googleapis.com/css2?family=Material+Symbols+Outlined:opsz,wght,FILL,GRAD@24,400,0,0');
 
-Usage: To draw an icon, set the font to 'Material Symbols Outlined' and use the ligature name as the text.
+# Both are created in open_pool(): AsyncPostgresSaver binds to the running
+# event loop when constructed, so it can't be built at import time
+memory: AsyncPostgresSaver | None = None
+graph = None
 
-Example: ctx.font = '50px "Material Symbols Outlined"'; ctx.fillText('call', x, y);
 
-Placement: Use icons to accent contact info, lists, or CTAs.
+_setup_done = False
 
-🖼 IMAGE SOURCE RULES (If Needed)
-If a stock image is required:
 
-Use https://picsum.photos/seed/{keyword}/{width}/{height}
+async def migrate():
+    """
+    Create or upgrade the checkpoint and session tables.
+    Normally run once per deploy via `python -m scripts.migrate`; the pool
+    must already be open. Concurrent runs, from any process, take turns.
+    """
+    global _setup_done
+
+    if _setup_done:
+        # Schema DDL only needs to run once per process
+        return
+
+    # Workers started together with RUN_MIGRATIONS=1 (or a deploy overlapping
+    # another) would otherwise run the DDL and rewrites concurrently. The
+    # transaction-scoped lock also works behind transaction-mode poolers, and
+    # Postgres releases it if this process dies mid-run.
+    # It is polled rather than waited on: a session blocked inside
+    # pg_advisory_xact_lock() holds a snapshot, and the CREATE INDEX
+    # CONCURRENTLY in memory.setup() would wait for it forever.
+    async with pool.connection() as lock_conn:
+        while True:
+            async with lock_conn.transaction():
+                cur = await lock_conn.execute(
+                    "SELECT pg_try_advisory_xact_lock(hashtext('recto-backend:migrate'))"
+                )
+                (locked,) = await cur.fetchone()
+                if locked:
+                    await _run_migrations()
+                    break
+            await asyncio.sleep(1)
+    _setup_done = True
+
+
+async def _run_migrations():
+    """The migration steps themselves; only called by migrate()."""
+    await memory.setup()
+    async with pool.connection() as conn:
+        await conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS chat_sessions (
+                thread_id text PRIMARY KEY,
+                user_id text NOT NULL,
+                session_id text NOT NULL,
+                preview text,
+                updated_at timestamptz NOT NULL DEFAULT now()
+            )
+            """
+        )
+        await conn.execute(
+            """
+            CREATE INDEX IF NOT EXISTS chat_sessions_user_id_updated_at_idx
+            ON chat_sessions (user_id, updated_at DESC)
+            """
+        )
+        # Thread keys used to be "user: session"; rewrite them to the
+        # current "user:session" form. Only legacy keys match (their first
+        # ':' is the one followed by a space), so reruns leave session ids
+        # containing ": " alone. All tables move together so no thread is
+        # left split.
+        async with conn.transaction():
+            for table in (
+                "checkpoints",
+                "checkpoint_blobs",
+                "checkpoint_writes",
+                "chat_sessions",
+            ):
+                await conn.execute(
+                    f"""
+                    UPDATE {table}
+                    SET thread_id = split_part(thread_id, ': ', 1) || ':'
+                        || substr(thread_id, strpos(thread_id, ': ') + 2)
+                    WHERE strpos(thread_id, ': ') > 0
+                      AND strpos(thread_id, ': ') = strpos(thread_id, ':')
+                    """
+                )
+        # One-off seed of sessions that predate chat_sessions, so the sidebar
+        # never has to scan checkpoints. Skipped once the table has rows.
+        await conn.execute(
+            """
+            INSERT INTO chat_sessions (thread_id, user_id, session_id, updated_at)
+            SELECT thread_id,
+                   split_part(thread_id, ':', 1),
+                   substr(thread_id, strpos(thread_id, ':') + 1),
+                   max((checkpoint->>'ts')::timestamptz)
+            FROM checkpoints
+            WHERE checkpoint_ns = ''
+              AND strpos(thread_id, ':') > 0
+              AND NOT EXISTS (SELECT 1 FROM chat_sessions)
+            GROUP BY thread_id
+            ON CONFLICT (thread_id) DO NOTHING
+            """
+        )
+        cur = await conn.execute(
+            "SELECT thread_id FROM chat_sessions WHERE preview IS NULL"
+        )
+        missing = [thread_id for (thread_id,) in await cur.fetchall()]
+
+    # Seeded sessions get the preview the sidebar used to show: the start
+    # of the first message, read from each thread's latest checkpoint
+    previews = []
+    for thread_id in missing:
+        config = {"configurable": {"thread_id": thread_id}}
+        checkpoint = await memory.aget_tuple(config)
+        if checkpoint is None:
+            continue
+        messages = checkpoint.checkpoint["channel_values"].get("messages", [])
+        first = next((m for m in messages if m.type == "human"), None)
+        if first is not None:
+            previews.append((first.content[:50], thread_id))
+    if previews:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.executemany(
+                    "UPDATE chat_sessions SET preview = %s WHERE thread_id = %s",
+                    previews,
+                )
+
+
+async def open_pool():
+    """
+    Open the connection pool and build the checkpointer and graph on it.
+    Called once on application startup.
+    Set RUN_MIGRATIONS=1 to also run migrate() here, e.g. in development.
+    """
+    global memory, graph
 
-Replace {keyword} with a specific subject.
+    await pool.open()
+    memory = AsyncPostgresSaver(pool)
+    graph = build_graph(memory)
+    if os.getenv("RUN_MIGRATIONS") == "1":
+        await migrate()
 
-MANDATORY: You must set img.crossOrigin = "anonymous"; before setting the src.
 
-📦 OUTPUT FORMAT (STRICT)
-You must respond with ONLY valid JSON — no markdown, no extra text. The JSON must contain exactly three keys: { "ai_message": "Short explanation of design choices.", "canvas": "Full standalone HTML document as a string", "title": "A short name for the design generated" }
+async def close_pool():
+    """Close the connection pool on application shutdown."""
+    await pool.close()
 
-⚙️ CODE RULES ("canvas" value)
-• No external CSS files. • Canvas default size: 1800 × 2400 vertical. • You MUST include a text-wrapping helper function. • Add these styles to the <canvas> element: max-width: 100%; max-height: 100%; object-fit: contain;.
 
-⏳ FONT & IMAGE LOADING LOGIC (MANDATORY)
-Canvas draws instantly — fonts and images must load first. Your JavaScript MUST follow this exact sequence:
+# Function to chat with agents
 
-Import Fonts: Defined in CSS.
 
-Wait for Fonts: You MUST wait for both your standard fonts AND the icon font.
+def thread_key(user_id: str, session_id: str) -> str:
+    """
+    Builds the LangGraph thread_id for a user's session.
+    The only place the key format is defined; chat_sessions stores
+    user_id and session_id separately so it never has to be parsed back.
+    """
+    return f"{user_id}:{session_id}"
 
-JavaScript
-document.fonts.load('10pt "Material Symbols Outlined"').then(() => {
-   document.fonts.ready.then(() => {
-       // Draw Logic Here
-   });
-});
-Load Images: If using images, load them inside the font promise.
 
-Draw: Execute drawing commands only after fonts and images are ready.
+def _flatten(content) -> str:
+    """
+    Gemini can return message content as a list of parts;
+    joins their text into a single string.
+    """
+    if type(content) is str:
+        # Most messages (and every streamed chunk) are plain strings
+        return content
+    if isinstance(content, list):
+        # Parts are dicts ({"type": "text", "text": ...}; thinking/other
+        # parts have no "text") or, per LangChain's content type, bare strings
+        return "".join(p if type(p) is str else p.get("text", "") for p in content)
+    return str(content)
 
-🧠 DESIGN ETHOS
-You are not a code generator — you are a visual designer with taste. Every canvas should look clean, balanced, and professionally spaced. If something feels crowded, fix it.
 
-Finally add this properties on the canvass element generated
+# One lock per thread, so concurrent turns on the same session run one
+# after another instead of forking its checkpoint history. Entries vanish
+# once no request holds or waits on the lock.
+_thread_locks = weakref.WeakValueDictionary()
 
-max-width: 100%;  /* Shrink to fit width */
-max-height: 100%; /* Shrink to fit height */
-object-fit: contain; /* Keeps the aspect ratio perfect */
-"""
-)
 
+def _thread_lock(thread_id: str) -> asyncio.Lock:
+    lock = _thread_locks.get(thread_id)
+    if lock is None:
+        lock = _thread_locks[thread_id] = asyncio.Lock()
+    return lock
 
-# Setting Message state
-class State(TypedDict):
-    messages: Annotated[list, add_messages]
 
+def _strip_fence(text: str) -> str:
+    """Drops a ```json fence if the model wrapped its output in one."""
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.removeprefix("```json").removeprefix("```").removesuffix("```").strip()
+    return text
 
-# Setting up nodes
-def chat_node(state: State):
-    messages = [sys_prompt] + state["messages"]
-    response = llm.invoke(messages)
-    return {"messages": [response]}
 
+def _clean_reply(text: str) -> str:
+    """
+    Returns a fresh model reply as bare JSON, logging replies that aren't
+    valid JSON so they are caught here rather than in the browser.
+    """
+    text = _strip_fence(text)
+    try:
+        orjson.loads(text)
+    except orjson.JSONDecodeError as e:
+        logger.warning("Model returned invalid JSON: %s", e)
+    return text
 
-# Building Graph
 
-builder = StateGraph(State)
-builder.add_node("chat_node", chat_node)
-builder.add_edge(START, "chat_node")
-builder.add_edge("chat_node", END)
+# The latest turn of each thread from the last 30 seconds, as
+# thread_id -> (message hash, reply). A browser or proxy retrying the same
+# POST gets the original answer back instead of a second Gemini call and a
+# duplicated turn in the history. Every completed turn replaces its
+# thread's entry, so only a repeat of the latest message is a retry.
+# Only used under the thread's lock, so a retry that arrives mid-turn
+# waits for the first attempt and then hits this cache.
+_recent_replies = TTLCache(maxsize=1024, ttl=30)
 
-memory = PostgresSaver(connection)
-memory.setup()
-graph = builder.compile(checkpointer=memory)
 
+def _message_digest(message: str) -> bytes:
+    return hashlib.blake2b(message.encode(), digest_size=16).digest()
 
-# Function to chat with agents
+
+async def _retried_reply(config, digest: bytes, message: str):
+    """
+    Returns the cached reply when `message` repeats the thread's latest
+    turn, else None.
+    """
+    entry = _recent_replies.get(config["configurable"]["thread_id"])
+    if entry is None or entry[0] != digest:
+        return None
+    # Another worker may have run a newer turn on this thread since
+    state = await graph.aget_state(config)
+    messages = state.values.get("messages", [])
+    if len(messages) < 2 or messages[-2].type != "human":
+        return None
+    if messages[-2].content != message:
+        return None
+    return entry[1]
+
+
+async def _touch_session(user_id: str, session_id: str, message: str):
+    """
+    Records the session in chat_sessions for the sidebar. The preview is
+    taken from the first message only; later turns just bump updated_at.
+    """
+    unique_id = thread_key(user_id, session_id)
+    async with pool.connection() as conn:
+        await conn.execute(
+            """
+            INSERT INTO chat_sessions (thread_id, user_id, session_id, preview, updated_at)
+            VALUES (%s, %s, %s, %s, now())
+            ON CONFLICT (thread_id) DO UPDATE
+            SET updated_at = excluded.updated_at,
+                preview = COALESCE(chat_sessions.preview, excluded.preview)
+            """,
+            (unique_id, user_id, session_id, message[:50]),
+        )
 
 
-def chat_with_agent(user_id: str, session_id: str, message: str):
+async def chat_with_agent(user_id: str, session_id: str, message: str):
     """
     Each user has a peculiar id which includes:
     1. Their personal user_id
@@ -141,19 +507,29 @@ def chat_with_agent(user_id: str, session_id: str, message: str):
 
     """
     try:
-        unique_id = f"{user_id}: {session_id}"
+        unique_id = thread_key(user_id, session_id)
         config = {"configurable": {"thread_id": unique_id}}
         human_msg = HumanMessage(content=message)
-        reply = graph.invoke({"messages": [human_msg]}, config=config)
 
-        last_msg = reply["messages"][-1]
+        digest = _message_digest(message)
 
-        content = last_msg.content
-        if isinstance(content, list):
-            text = "".join(p["text"] for p in content if "text" in p)
+        async with _thread_lock(unique_id):
+            text = await _retried_reply(config, digest, message)
+            if text is not None:
+                return text
 
-        else:
-            text = str(content)
+            # "updates" yields only what chat_node returned this turn, instead
+            # of the full merged state with the whole message history
+            last_msg = None
+            async for update in graph.astream(
+                {"messages": [human_msg]}, config=config, stream_mode="updates"
+            ):
+                if "chat_node" in update:
+                    last_msg = update["chat_node"]["messages"][-1]
+            await _touch_session(user_id, session_id, message)
+
+            text = _clean_reply(_flatten(last_msg.content))
+            _recent_replies[unique_id] = (digest, text)
 
         return text
 
@@ -161,84 +537,155 @@ def chat_with_agent(user_id: str, session_id: str, message: str):
         return f"Error : {str(e)}"
 
 
-# Add this function at the end of your file
+async def stream_chat_with_agent(user_id: str, session_id: str, message: str):
+    """
+    Streaming variant of chat_with_agent.
+    Yields the AI response text chunk by chunk as Gemini generates it;
+    the full turn is still checkpointed once the graph run finishes.
+    """
+    unique_id = thread_key(user_id, session_id)
+    config = {"configurable": {"thread_id": unique_id}}
+    human_msg = HumanMessage(content=message)
 
+    digest = _message_digest(message)
 
-def get_conversation_history(user_id: str, session_id: str):
-    """
-    Gets the conversation history for a specific user session.
+    async with _thread_lock(unique_id):
+        cached = await _retried_reply(config, digest, message)
+        if cached is not None:
+            yield cached
+            return
 
-    Returns:
-        list: [
-            {'role': 'user', 'content': '...'},
-            {'role': 'ai', 'content': '...'},
-            ...
-        ]
-    """
-    try:
-        unique_id = f"{user_id}: {session_id}"
-        config = {"configurable": {"thread_id": unique_id}}
+        parts = []
+        # "messages" mode yields only LLM token chunks, without the per-node
+        # and per-runnable events astream_events builds for every step
+        async for chunk, metadata in graph.astream(
+            {"messages": [human_msg]}, config=config, stream_mode="messages"
+        ):
+            if metadata.get("langgraph_node") != "chat_node":
+                continue
 
-        # Get state from graph
-        state = graph.get_state(config)
+            text = _flatten(chunk.content)
+            if text:
+                parts.append(text)
+                yield text
 
-        # Extract messages
-        conversation = []
-        for msg in state.values.get("messages", []):
-            if isinstance(msg, HumanMessage):
-                conversation.append({"role": "user", "content": msg.content})
-            elif isinstance(msg, AIMessage):
-                content = msg.content
-                if isinstance(content, list):
-                    text = "".join(p["text"] for p in content if "text" in p)
-                else:
-                    text = str(content)
+        await _touch_session(user_id, session_id, message)
+        _recent_replies[unique_id] = (digest, _clean_reply("".join(parts)))
 
-                conversation.append({"role": "ai", "content": text})
 
-        return conversation
+# Add this function at the end of your file
 
-    except Exception as e:
-        return []
 
+# LangChain message type -> role exposed by the API; anything else
+# (system/tool messages) is not part of the visible conversation
+_ROLES = {"human": "user", "ai": "ai"}
 
-def get_all_user_sessions(user_id: str):
+
+async def _load_conversation(user_id: str, session_id: str):
     """
-    Get all chat sessions for a user (for sidebar).
-    Returns list of sessions with first message as preview.
+    Loads the user/ai messages of a session from the latest checkpoint,
+    oldest first, as LangChain message objects.
     """
-    try:
-        cursor = connection.cursor()
+    unique_id = thread_key(user_id, session_id)
+    config = {"configurable": {"thread_id": unique_id}}
 
-        # Find all conversations for this user
-        cursor.execute(
-            """
-            SELECT DISTINCT thread_id 
-            FROM checkpoints 
-            WHERE thread_id LIKE %s
-        """,
-            (f"{user_id}:%",),
-        )
+    # Get state from graph
+    state = await graph.aget_state(config)
+
+    return [msg for msg in state.values.get("messages", []) if msg.type in _ROLES]
+
+
+def _format_message(msg):
+    role = _ROLES[msg.type]
+    if role == "user":
+        return {"id": msg.id, "role": role, "content": msg.content}
+    return {"id": msg.id, "role": role, "content": _strip_fence(_flatten(msg.content))}
+
+
+async def get_conversation_history(
+    user_id: str, session_id: str, limit: int = 50, before: str | None = None
+):
+    """
+    Gets one page of the conversation history for a specific user session.
+
+    Messages are returned oldest first. The newest `limit` messages are
+    returned unless `before` is given, in which case the page ends just
+    before the message with that id. Pass `next_cursor` back as `before`
+    to load the previous (older) page; it is None once the start of the
+    conversation is reached. An unknown `before` id yields an empty page.
 
-        results = cursor.fetchall()
+    Returns:
+        dict: {
+            'messages': [
+                {'id': '...', 'role': 'user', 'content': '...'},
+                {'id': '...', 'role': 'ai', 'content': '...'},
+                ...
+            ],
+            'next_cursor': '...' | None,
+        }
+    """
+    try:
+        conversation = await _load_conversation(user_id, session_id)
+
+        end = len(conversation)
+        if before is not None:
+            end = next(
+                (i for i, m in enumerate(conversation) if m.id == before), None
+            )
+            if end is None:
+                # Unknown cursor (e.g. the session was deleted meanwhile):
+                # an empty last page, rather than restarting from the newest
+                return {"messages": [], "next_cursor": None}
+        start = max(end - limit, 0)
+        next_cursor = conversation[start].id if start > 0 else None
+
+        # Only the requested page is formatted
+        page = [_format_message(msg) for msg in conversation[start:end]]
+        return {"messages": page, "next_cursor": next_cursor}
 
-        sessions = []
-        for row in results:
-            thread_id = row[0]  # e.g., "user123: session456"
+    except Exception as e:
+        return {"messages": [], "next_cursor": None}
 
-            # Extract session_id
-            session_id = thread_id.split(": ")[1]
 
-            # Get first message as preview
-            history = get_conversation_history(user_id, session_id)
-            preview = "New chat"
-            if history and len(history) > 0:
-                preview = history[0]["content"][:50]  # First 50 characters
+async def delete_conversation(user_id: str, session_id: str):
+    """
+    Deletes a session: all of its checkpoints (and their blobs/writes)
+    plus its chat_sessions row.
+    """
+    unique_id = thread_key(user_id, session_id)
+    await memory.adelete_thread(unique_id)
+    _recent_replies.pop(unique_id, None)
+    async with pool.connection() as conn:
+        await conn.execute(
+            "DELETE FROM chat_sessions WHERE thread_id = %s", (unique_id,)
+        )
 
-            sessions.append({"session_id": session_id, "preview": preview})
 
-        cursor.close()
-        return sessions
+async def get_all_user_sessions(user_id: str, limit: int = 50, offset: int = 0):
+    """
+    Get a user's chat sessions for the sidebar, most recently active first.
+    Returns list of sessions with first message as preview.
+    """
+    try:
+        async with pool.connection() as conn:
+            async with conn.cursor() as cur:
+                await cur.execute(
+                    """
+                    SELECT session_id, preview
+                    FROM chat_sessions
+                    WHERE user_id = %s
+                    ORDER BY updated_at DESC
+                    LIMIT %s OFFSET %s
+                    """,
+                    (user_id, limit, offset),
+                )
+
+                results = await cur.fetchall()
+
+        return [
+            {"session_id": session_id, "preview": preview or "New chat"}
+            for session_id, preview in results
+        ]
 
     except Exception as e:
         return []
@@ -1,3 +1,9 @@
+import asyncio
+import hashlib
+import time
+
+import jwt
+from cachetools import TLRUCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from database import supabase
@@ -5,15 +11,51 @@ from database import supabase
 
 security = HTTPBearer()
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# How long a token verified by Supabase is trusted without asking again
+TOKEN_CACHE_TTL = 300  # seconds
+
+
+def _token_ttu(key, value, now):
+    # Never keep a token past its own expiry
+    _, expires_at = value
+    return min(now + TOKEN_CACHE_TTL, expires_at)
+
+
+# Keyed by a hash of the token so raw tokens are never held in memory.
+# Only touched from the event loop, so it needs no lock.
+_token_cache = TLRUCache(maxsize=10_000, ttu=_token_ttu, timer=time.time)
+
+
+def _token_expiry(token: str) -> float:
+    # Only read after Supabase has verified the token, so the signature
+    # doesn't need checking again here
+    try:
+        return jwt.decode(token, options={"verify_signature": False})["exp"]
+    except Exception:
+        return 0
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security),
+):
     token = credentials.credentials
+    key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    cached = _token_cache.get(key)
+    if cached is not None:
+        return cached[0]
+
     try:
-        # We ask Supabase to verify this specific token
-        user = supabase.auth.get_user(token)
-        return user
+        # We ask Supabase to verify this specific token; the client is
+        # blocking, so keep it off the event loop
+        user = await asyncio.to_thread(supabase.auth.get_user, token)
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
-        )
\ No newline at end of file
+        )
+
+    if user is not None:
+        _token_cache[key] = (user, _token_expiry(token))
+    return user
@@ -1,41 +1,79 @@
-from typing import Annotated
+import asyncio
+import logging
+import orjson
+import queue
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 from auth import get_current_user
 from database import supabase
-from typing_extensions import TypedDict
 
-from fastapi import Depends, FastAPI, HTTPException
+from fastapi import Depends, FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from dotenv import load_dotenv
 
 load_dotenv()
-from fastapi import FastAPI
-from pydantic import BaseModel, EmailStr
+from schemas import ChatRequest, ChatResponse, SignupSchema, LoginSchema
 from agent.chatbot import (
     chat_with_agent,
+    stream_chat_with_agent,
     get_conversation_history,
     get_all_user_sessions,
-    connection,
+    delete_conversation,
+    open_pool,
+    close_pool,
+    warm_up_llm,
+    keep_prompt_cache_fresh,
 )
 
 
-app = FastAPI()
-# Defining the class the backend receives and sends
+logger = logging.getLogger(__name__)
 
 
-class ChatRequest(BaseModel):
-    session_id: str
-    message: str
-
-
-class ChatResponse(BaseModel):
-    user_id: str
-    session_id: str
-    response: str
+def start_log_listener():
+    """
+    Routes logging through a queue: log calls only enqueue the record and a
+    background thread writes it out, so stdout/journald backpressure never
+    blocks the event loop. Returns the listener, to be stopped on shutdown.
+    """
+    log_queue = queue.SimpleQueue()
+    # Root stays at WARNING so httpx / google_genai don't log every request;
+    # only our own loggers go down to INFO
+    logging.basicConfig(
+        level=logging.WARNING, handlers=[QueueHandler(log_queue)], force=True
+    )
+    for name in (__name__, "agent"):
+        logging.getLogger(name).setLevel(logging.INFO)
+    listener = QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    return listener
 
 
 # --- 3. FASTAPI APP ---
 
-app = FastAPI(title="Recto AI Backend")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Set up here rather than at import: `python main.py` imports this file
+    # twice (as __main__ and as main), and only the served app should own it
+    log_listener = start_log_listener()
+    # Each worker opens its own connection pool on startup; the database
+    # and Gemini warm-ups are independent, so run them together
+    await asyncio.gather(open_pool(), warm_up_llm())
+    cache_refresher = asyncio.create_task(keep_prompt_cache_fresh())
+    yield
+    cache_refresher.cancel()
+    await close_pool()
+    log_listener.stop()
+
+
+# orjson encodes the large history/canvas payloads much faster than stdlib json
+app = FastAPI(
+    title="Recto AI Backend",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 origins = [
     "http://localhost:3000",  # React default port
@@ -49,50 +87,97 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # Allowed domains
     allow_credentials=True,  # Allow cookies/auth headers
-    allow_methods=["*"],  # Allow all HTTP methods (GET, POST, etc.)
-    allow_headers=["*"],  # Allow all headers
+    # Only what the frontend sends; explicit lists let Starlette answer
+    # preflights without echoing the requested methods/headers back
+    allow_methods=["GET", "POST", "DELETE"],
+    allow_headers=["Authorization", "Content-Type"],
 )
+# Canvas HTML replies are 5-15 KB of highly repetitive text; Starlette
+# leaves text/event-stream uncompressed, so /chat/stream is unaffected
+app.add_middleware(GZipMiddleware, minimum_size=1000)
 
 
 @app.get("/health")
-def health_check():
+async def health_check():
     return {"message": "System is in good condition"}
 
 
-@app.post("/chat")
+# ChatResponse only documents the body; returning the response directly
+# skips building the model and running jsonable_encoder over the reply
+@app.post("/chat", responses={200: {"model": ChatResponse}})
 async def chats(request: ChatRequest, user=Depends(get_current_user)):
     try:
-        reply = chat_with_agent(
+        reply = await chat_with_agent(
             user_id=user.user.id,
             session_id=request.session_id,
             message=request.message,
         )
-        return ChatResponse(
-            user_id=user.user.id, session_id=request.session_id, response=reply
+        return ORJSONResponse(
+            {"user_id": user.user.id, "session_id": request.session_id, "response": reply}
         )
     except Exception as e:
-        # It's helpful to print the error to console for debugging
-        print(f"Error: {e}")
+        logger.exception("Chat request failed")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, user=Depends(get_current_user)):
+    """
+    Same as /chat, but streams the reply as Server-Sent Events: one
+    `data: {"delta": "..."}` event per text chunk, then a final `done` event
+    (or an `error` event with `{"detail": "..."}`).
+    """
+    user_id = user.user.id
+
+    async def event_stream():
+        try:
+            async for text in stream_chat_with_agent(
+                user_id=user_id,
+                session_id=request.session_id,
+                message=request.message,
+            ):
+                yield b"data: " + orjson.dumps({"delta": text}) + b"\n\n"
+        except Exception as e:
+            logger.exception("Chat stream failed")
+            yield b"event: error\ndata: " + orjson.dumps({"detail": str(e)}) + b"\n\n"
+            return
+        yield b"event: done\ndata: {}\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.get("/history/{session_id}")
-async def get_history(session_id: str, user=Depends(get_current_user)):
+async def get_history(
+    session_id: str,
+    limit: int = Query(50, ge=1, le=200),
+    before: str | None = None,
+    user=Depends(get_current_user),
+):
+    """
+    Get one page of a session's history (the newest messages by default).
+    Pass `next_cursor` back as `before` to load older messages.
+    """
     user_id = user.user.id
     # Call the agent function
-    history = get_conversation_history(user_id, session_id)
+    history = await get_conversation_history(
+        user_id, session_id, limit=limit, before=before
+    )
 
-    return {"conversation": history}
+    return {"conversation": history["messages"], "next_cursor": history["next_cursor"]}
 
 
 @app.get("/sessions")
-def get_sessions_per_user(user=Depends(get_current_user)):
+async def get_sessions_per_user(
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    user=Depends(get_current_user),
+):
     """
     Get all sessions peculiar to each user
     """
     user_id = user.user.id
-    sessions = get_all_user_sessions(user_id)
+    sessions = await get_all_user_sessions(user_id, limit=limit, offset=offset)
     return {"user_id": user_id, "sessions": sessions}
 
 
@@ -102,41 +187,16 @@ async def delete_session(session_id: str, user=Depends(get_current_user)):
     Delete all stored checkpoints for a given user session.
     """
     try:
-        user_id = user.user.id
-        unique_id = f"{user_id}: {session_id}"
-        cursor = connection.cursor()
-        cursor.execute(
-            """
-            DELETE FROM checkpoints
-            WHERE thread_id = %s
-            """,
-            (unique_id,)
-        )
-        cursor.close()
+        await delete_conversation(user.user.id, session_id)
         return {"message": "Session deleted", "session_id": session_id}
     except Exception as e:
-        print(f"Error deleting session: {e}")
+        logger.exception("Error deleting session")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # Authentication
 
 
-class SignupSchema(BaseModel):
-    """Schema for the user signup request body."""
-
-    email: EmailStr
-    password: str
-    display_name: str
-
-
-class LoginSchema(BaseModel):
-    """Schema for the user signup request body."""
-
-    email: EmailStr
-    password: str
-
-
 @app.post("/signup")
 def signup(payload: SignupSchema):
     try:
@@ -151,7 +211,7 @@ def signup(payload: SignupSchema):
             raise HTTPException(status_code=400, detail="Signup failed")
         return {"message": "User created", "user": res.user}
     except Exception as e:
-        print(e)
+        logger.warning("Signup failed: %s", e)
         raise HTTPException(status_code=401, detail=str(e))
 
 
@@ -163,12 +223,12 @@ def login(payload: LoginSchema):
         )
         return {"access_token": res.session.access_token, "token_type": "bearer"}
     except Exception as e:
-        print(e)
+        logger.warning("Login failed: %s", e)
         raise HTTPException(status_code=401, detail=str(e))
 
 
 @app.get("/get_profile")
-def get_user_details(user=Depends(get_current_user)):
+async def get_user_details(user=Depends(get_current_user)):
     # 'user' is the object returned by supabase.auth.get_user(token)
     
     return {
@@ -180,8 +240,17 @@ def get_user_details(user=Depends(get_current_user)):
     }
 
 
-# --- 4. RUNNER (For debugging) ---
+# --- 4. RUNNER ---
 if __name__ == "__main__":
+    import os
     import uvicorn
 
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Each worker is a separate process with its own event loop and its own
+    # connection pool (opened in lifespan, after the worker starts).
+    # uvicorn picks uvloop/httptools automatically when they are installed.
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("WEB_CONCURRENCY", "4")),
+    )
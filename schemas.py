@@ -0,0 +1,36 @@
+from pydantic import BaseModel, ConfigDict, EmailStr
+
+
+# Defining the class the backend receives and sends
+
+
+class ChatRequest(BaseModel):
+    # Unknown keys are rejected up front instead of being parsed and dropped
+    model_config = ConfigDict(extra="forbid")
+
+    session_id: str
+    message: str
+
+
+class ChatResponse(BaseModel):
+    user_id: str
+    session_id: str
+    response: str
+
+
+# Authentication
+
+
+class SignupSchema(BaseModel):
+    """Schema for the user signup request body."""
+
+    email: EmailStr
+    password: str
+    display_name: str
+
+
+class LoginSchema(BaseModel):
+    """Schema for the user login request body."""
+
+    email: EmailStr
+    password: str
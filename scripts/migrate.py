@@ -0,0 +1,24 @@
+"""
+Creates or upgrades the database tables used by the agent
+(LangGraph checkpoints and chat_sessions).
+
+Run once per deploy, from the project root:
+
+    python -m scripts.migrate
+"""
+
+import asyncio
+
+from agent.chatbot import open_pool, close_pool, migrate
+
+
+async def main():
+    await open_pool()
+    try:
+        await migrate()
+    finally:
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
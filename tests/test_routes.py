@@ -0,0 +1,37 @@
+import importlib
+
+# The app's full route table, including FastAPI's docs routes
+EXPECTED_ROUTES = {
+    ("/openapi.json", "GET"),
+    ("/docs", "GET"),
+    ("/docs/oauth2-redirect", "GET"),
+    ("/redoc", "GET"),
+    ("/health", "GET"),
+    ("/chat", "POST"),
+    ("/chat/stream", "POST"),
+    ("/history/{session_id}", "GET"),
+    ("/sessions", "GET"),
+    ("/session/delete/{session_id}", "DELETE"),
+    ("/signup", "POST"),
+    ("/login", "POST"),
+    ("/get_profile", "GET"),
+}
+
+
+def test_app_imports_and_registers_routes(monkeypatch):
+    # Importing main must not need a database or Gemini: the pool is only
+    # opened (and the graph built) in the app lifespan
+    monkeypatch.setenv("SUPABASE_URL", "https://test.supabase.co")
+    monkeypatch.setenv("SUPABASE_ANON_KEY", "test-anon-key")
+    monkeypatch.setenv("SUPABASE_DB_URL", "postgresql://localhost/test")
+    monkeypatch.setenv("GOOGLE_API_KEY", "test-google-api-key")
+
+    main = importlib.import_module("main")
+
+    routes = {
+        (route.path, method)
+        for route in main.app.routes
+        for method in route.methods - {"HEAD"}
+    }
+    assert len(main.app.routes) == 13
+    assert routes == EXPECTED_ROUTES